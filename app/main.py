@@ -1,11 +1,23 @@
 import os
+import sys
+import asyncio
+import functools
+import hashlib
+import unicodedata
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import googlemaps
+import httpx
+import orjson
+from diskcache import Cache
 from dotenv import load_dotenv
-from typing import Dict, List, Set
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
 import math
+import re
 import logging
+import logging.handlers
 import time
 from datetime import datetime
 
@@ -18,11 +30,15 @@ if not os.path.exists('log'):
     os.makedirs('log')
 
 # ロギング設定
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+file_handler = logging.FileHandler(log_filename, mode='a')
+file_handler.setFormatter(logging.Formatter(log_format))
+# ファイルへの書き込みはバッファにためてまとめて行う（ERROR以上は即時に書き込む）
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=log_format,
     handlers=[
-        logging.FileHandler(log_filename, mode='a'),
+        logging.handlers.MemoryHandler(capacity=1024, flushLevel=logging.ERROR, target=file_handler),
         logging.StreamHandler()
     ]
 )
@@ -31,10 +47,111 @@ logger = logging.getLogger(__name__)
 # 環境変数の読み込み
 load_dotenv()
 
-app = FastAPI(title="find_location_api")
-
 # Google Maps APIクライアントの初期化
-gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"))
+GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
+
+# Google Maps API（Places API）の接続先
+GOOGLE_MAPS_BASE_URL = "https://maps.googleapis.com"
+PLACES_NEARBY_PATH = "/maps/api/place/nearbysearch/json"
+
+# Places APIへの同時リクエスト数の上限（アプリ全体で共有する）
+# 待機中のページ送りは枠を消費しないため、各検索の待機時間は並行して経過する
+MAX_CONCURRENT_REQUESTS = int(os.getenv("PLACES_MAX_CONCURRENCY", "20"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Places API用のHTTPクライアントと同時リクエスト数の制限をアプリ全体で共有する
+    HTTP/2の多重化と接続の再利用により、リクエストごとのTLSハンドシェイクを省く
+    同時に複数の検索が行われても、Places APIへの同時リクエスト数は上限を超えない
+    """
+    async with httpx.AsyncClient(
+        http2=True,
+        base_url=GOOGLE_MAPS_BASE_URL,
+        timeout=10,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=50)
+    ) as client:
+        app.state.http_client = client
+        app.state.places_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        yield
+
+app = FastAPI(title="find_location_api", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# next_page_tokenが有効になるまでの待機時間（秒）
+PAGE_TOKEN_DELAY = 2
+# 1回の検索で取得する最大ページ数と、ページ取得の最大試行回数
+MAX_PAGES = 3
+MAX_RETRIES = 3
+
+# キャッシュの保存先
+CACHE_DIR = 'cache'
+# 地域名キャッシュの有効期限（30日）
+AREA_CACHE_TTL = 30 * 24 * 60 * 60
+# 地域名の取り出し方を変更した場合は上げて古いキャッシュを無効化する
+AREA_CACHE_VERSION = 2
+area_cache = Cache(os.path.join(CACHE_DIR, 'area'))
+# 住所文字列から市区町村名（政令指定都市は区まで）を取り出すパターン
+# 市名の途中に「市」を含み、最初の「市」で区切ると誤る市は個別に列挙する
+# 町村は町名・丁目と区別できないため、郡または都道府県の直後にある場合のみ市区町村とみなす
+PREFECTURE_PATTERN = r"(?:東京都|北海道|(?:京都|大阪)府|\S{2,3}県)"
+AREA_PATTERN = re.compile(
+    r"^(?:日本、)?(?:〒?\d{3}-\d{4}\s*)?"
+    r"(?:" + PREFECTURE_PATTERN + r"?(?P<city>四日市市|廿日市市|野々市市|(?:\S+?市)?\S+?区|\S+?市|\S+?郡\S+?[町村])"
+    r"|" + PREFECTURE_PATTERN + r"(?P<town>\S+?[町村]))"
+)
+
+# 検索結果キャッシュの有効期限（7日）
+PLACES_CACHE_TTL = 7 * 24 * 60 * 60
+# 検索カテゴリや結果の形式を変更した場合は上げて古いキャッシュを無効化する
+PLACES_CACHE_VERSION = 8
+places_cache = Cache(os.path.join(CACHE_DIR, 'places'))
+# ジオコーディング結果キャッシュの有効期限（30日）
+GEOCODE_CACHE_TTL = 30 * 24 * 60 * 60
+geocode_cache = Cache(os.path.join(CACHE_DIR, 'geocode'))
+
+class Category(NamedTuple):
+    key: str  # LocationResponseのフィールド名
+    place_type: str  # 検索した種類
+    pattern: Optional[Pattern]  # 店名の判定パターン
+    display_name: str  # PlaceInfo.place_typeに設定する表示名
+
+# 店舗カテゴリ
+# 上から順に判定し、店名がパターンに一致する最初のカテゴリに振り分ける
+# パターンがNoneのカテゴリはその種類で他に一致しなかった店舗をすべて受け取る
+CATEGORIES = (
+    Category("ramen_shops", "restaurant",
+             re.compile("ラーメン|らーめん|拉麺|中華そば|つけ麺|油そば|まぜそば|担々麺|担担麺|タンメン"), "ラーメン"),
+    Category("soba_udon_shops", "restaurant",
+             re.compile("(?<!焼)(?<!焼き)そば|蕎麦|うどん|饂飩"), "そば・うどん"),
+    Category("izakaya", "restaurant",
+             re.compile("居酒屋|酒場|焼鳥|焼き鳥|やきとり|串焼|炉端|立ち飲み|立飲|ダイニングバー"), "居酒屋"),
+    Category("family_restaurants", "restaurant",
+             re.compile("ファミリーレストラン|ガスト|サイゼリヤ|デニーズ|ジョナサン|ロイヤルホスト|ココス|バーミヤン|ジョリーパスタ"),
+             "ファミリーレストラン"),
+    Category("general_restaurants", "restaurant", None, "一般飲食店"),
+    Category("cafes", "cafe", None, "カフェ"),
+)
+
+# グリッドポイントごとに検索する種類（先に並ぶ種類の結果を優先する）
+SEARCH_TYPES = tuple(dict.fromkeys(category.place_type for category in CATEGORIES))
+
+# 最初に検索するセルの一辺と、それ以上分割しないセルの一辺（m）
+INITIAL_CELL_SIZE = 2000
+MIN_CELL_SIZE = 250
+# 1mあたりの緯度・経度（約1km = 緯度0.009度・経度0.011度）
+LAT_PER_METER = 0.009 / 1000
+LNG_PER_METER = 0.011 / 1000
+# グリッドの行数・列数を整数で計算するときの1度あたりの単位数
+GRID_UNITS_PER_DEGREE = 10 ** 7
+# 最大取得件数（20件×3ページ）に近い件数が返った種類は取りこぼしがあるとみなす
+SATURATION_THRESHOLD = 57
+
+class Cell(NamedTuple):
+    lat: float  # セル中心の緯度
+    lng: float  # セル中心の経度
+    size: int  # セルの一辺（m）
+    place_types: Tuple[str, ...]  # このセルで検索する種類
 
 class PlaceInfo(BaseModel):
     name: str
@@ -56,222 +173,468 @@ class LocationResponse(BaseModel):
     cafes: List[PlaceInfo]
     processing_time: float  # 処理時間を追加
 
-def get_area_grid_points(bounds):
+def get_area_grid_points(bounds) -> List[Cell]:
     """
-    指定された境界内のグリッドポイントを生成
+    指定された境界を覆う初期セル（約2km四方）を生成
+    行政界のポリゴンは取得していないため、境界の矩形内はすべて検索対象とする
+    （ジオコーディング結果のviewportも同じ矩形のため、これによる絞り込みはできない）
     """
     ne = bounds['northeast']
     sw = bounds['southwest']
     
-    # 約1km間隔でグリッドを作成
-    lat_step = 0.009  # 約1km
-    lng_step = 0.011  # 約1km
+    # 1e-7度単位の整数で計算し、浮動小数点の誤差で余分な行・列が増えるのを防ぐ
+    lat_step = round(INITIAL_CELL_SIZE * LAT_PER_METER * GRID_UNITS_PER_DEGREE)
+    lng_step = round(INITIAL_CELL_SIZE * LNG_PER_METER * GRID_UNITS_PER_DEGREE)
+    lat_span = round((ne['lat'] - sw['lat']) * GRID_UNITS_PER_DEGREE)
+    lng_span = round((ne['lng'] - sw['lng']) * GRID_UNITS_PER_DEGREE)
     
-    lat_points = math.ceil((ne['lat'] - sw['lat']) / lat_step)
-    lng_points = math.ceil((ne['lng'] - sw['lng']) / lng_step)
+    lat_points = max(1, -(-lat_span // lat_step))
+    lng_points = max(1, -(-lng_span // lng_step))
     
-    logger.info(f"グリッドサイズ: {lat_points}x{lng_points} = {lat_points * lng_points}ポイント")
+    logger.info("グリッドサイズ: %dx%d = %dポイント", lat_points, lng_points, lat_points * lng_points)
     
-    grid_points = []
-    for i in range(lat_points):
-        for j in range(lng_points):
-            lat = sw['lat'] + (i * lat_step)
-            lng = sw['lng'] + (j * lng_step)
-            if lat <= ne['lat'] and lng <= ne['lng']:
-                grid_points.append({'lat': lat, 'lng': lng})
+    # セル全体の中心を境界の中心に合わせる
+    # 境界が点の場合（boundsがなく位置のみの場合）はその点を中心とする1セルになる
+    lats = [
+        sw['lat'] + (lat_span + (2 * i - (lat_points - 1)) * lat_step) / (2 * GRID_UNITS_PER_DEGREE)
+        for i in range(lat_points)
+    ]
+    lngs = [
+        sw['lng'] + (lng_span + (2 * j - (lng_points - 1)) * lng_step) / (2 * GRID_UNITS_PER_DEGREE)
+        for j in range(lng_points)
+    ]
     
-    return grid_points
+    return [Cell(lat, lng, INITIAL_CELL_SIZE, SEARCH_TYPES) for lat in lats for lng in lngs]
 
-def get_all_places(gmaps, location, keyword, place_type, radius=500):
+def subdivide_cell(cell: Cell, place_types: Tuple[str, ...]) -> List[Cell]:
     """
-    特定のキーワードと種類で店舗を検索し、すべての結果を返す
+    セルを4分割し、指定された種類だけを検索する子セルを返す
     """
-    MAX_RETRIES = 3
-    MAX_PAGES = 3  # 最大ページ数を制限
-    results = []
-    
-    try:
-        response = gmaps.places_nearby(
-            location=location,
-            keyword=keyword,
-            type=place_type,
-            radius=radius,
-            language="ja"
+    size = cell.size // 2
+    lat_offset = size / 2 * LAT_PER_METER
+    lng_offset = size / 2 * LNG_PER_METER
+    return [
+        Cell(cell.lat + lat_sign * lat_offset, cell.lng + lng_sign * lng_offset, size, place_types)
+        for lat_sign in (-1, 1) for lng_sign in (-1, 1)
+    ]
+
+async def fetch_places_page(client, sem, params):
+    """
+    Places APIのNearby Searchを1ページ分取得する
+    """
+    async with sem:
+        response = await client.get(
+            PLACES_NEARBY_PATH,
+            params={**params, "key": GOOGLE_MAPS_API_KEY}
         )
+    response.raise_for_status()
+    data = response.json()
+    status = data.get('status')
+    if status not in ('OK', 'ZERO_RESULTS'):
+        raise RuntimeError(f"{status} {data.get('error_message', '')}".strip())
+    return data
+
+async def fetch_page_with_retry(client, sem, params, place_type, page) -> Optional[dict]:
+    """
+    1ページ分を取得し、失敗した場合はNoneを返す
+    2ページ目以降はnext_page_tokenが有効になっていない場合があるため、待機して再試行する
+    """
+    retries = MAX_RETRIES if page > 1 else 1
+    for retry_count in range(1, retries + 1):
+        try:
+            return await fetch_places_page(client, sem, params)
+        except Exception as e:
+            if retry_count == retries:
+                if page > 1:
+                    logger.error("ページ取得エラー: %s - %s", place_type, e)
+                else:
+                    logger.error("検索エラー: %s - %s", place_type, e)
+                return None
+            await asyncio.sleep(PAGE_TOKEN_DELAY)
+
+async def search_point(client, sem, cell, index, total) -> Tuple[Dict[str, List[dict]], bool]:
+    """
+    1つのセルで検索対象の種類を並行して検索する
+    全種類の同じページをまとめて取得し、次のページまでの待機は全種類で1回だけ行う
+    検索半径はセル全体を覆うよう、中心から角までの距離とする
+    (種類ごとの検索結果, 取得に失敗したページがあったか)を返す
+    """
+    logger.info("ポイント %d/%d の検索中", index, total)
+    radius = math.ceil(cell.size / math.sqrt(2))
+    results = {place_type: [] for place_type in cell.place_types}
+    requests = {
+        place_type: {
+            'location': f"{cell.lat},{cell.lng}",
+            'type': place_type,
+            'radius': radius,
+            'language': "ja"
+        }
+        for place_type in cell.place_types
+    }
+    
+    failed = False
+    page = 1
+    while requests:
+        responses = await asyncio.gather(*(
+            fetch_page_with_retry(client, sem, params, place_type, page)
+            for place_type, params in requests.items()
+        ))
         
-        # 最初のページの結果を追加
-        if 'results' in response:
-            results.extend(response['results'])
-            logger.debug(f"検索結果: {keyword} - {len(response['results'])}件")
+        next_requests = {}
+        for place_type, response in zip(requests, responses):
+            if response is None:
+                failed = True
+                continue
+            results[place_type].extend(response.get('results', []))
+            logger.debug("検索結果: %s - ページ%d - %d件", place_type, page, len(response.get('results', [])))
+            # 次のページがある場合は取得を続ける（最大ページ数を制限）
+            if 'next_page_token' in response and page < MAX_PAGES:
+                next_requests[place_type] = {'pagetoken': response['next_page_token']}
         
-        # 次のページがある場合は取得を続ける
-        page_count = 1
-        while 'next_page_token' in response and page_count < MAX_PAGES:
-            page_count += 1
-            retry_count = 0
-            
-            while retry_count < MAX_RETRIES:
-                try:
-                    time.sleep(2)  # APIの制限に対する待機時間
-                    response = gmaps.places_nearby(
-                        location=location,
-                        page_token=response['next_page_token']
-                    )
-                    if 'results' in response:
-                        results.extend(response['results'])
-                        logger.debug(f"追加の検索結果: {keyword} - ページ{page_count} - {len(response['results'])}件")
-                    break
-                except Exception as e:
-                    retry_count += 1
-                    if retry_count == MAX_RETRIES:
-                        logger.error(f"ページ取得エラー: {keyword} - {str(e)}")
-                        break
-                    time.sleep(2)
+        requests = next_requests
+        page += 1
+        if requests:
+            await asyncio.sleep(PAGE_TOKEN_DELAY)  # APIの制限に対する待機時間
     
-    except Exception as e:
-        logger.error(f"検索エラー: {keyword} - {str(e)}")
+    return results, failed
+
+def bucket_places(point_results: List[Dict[str, List[dict]]]) -> Dict[str, List[dict]]:
+    """
+    全グリッドポイントの検索結果を重複排除し、カテゴリごとに振り分ける
+    カテゴリごとにplace_idをキーとした辞書へ格納し、一度の走査で振り分ける
+    """
+    seen_ids = set()
+    add_seen_id = seen_ids.add
+    buckets = {category.key: {} for category in CATEGORIES}
+    for place_type in SEARCH_TYPES:
+        for results in point_results:
+            for place in results.get(place_type, ()):
+                place_id = place['place_id']
+                if place_id not in seen_ids:
+                    add_seen_id(place_id)
+                    buckets[classify_place(place, place_type)][place_id] = place
+    return {key: list(bucket.values()) for key, bucket in buckets.items()}
+
+async def search_grid(client, sem, cells: List[Cell],
+                      on_result: Optional[Callable[[Dict[str, List[dict]]], None]] = None,
+                      on_progress: Optional[Callable[[int, int], None]] = None
+                      ) -> Tuple[List[Dict[str, List[dict]]], bool]:
+    """
+    セルを並行して検索し、取得件数が上限に近かった種類はセルを4分割して再検索する
+    店舗の少ない地域は粗いセルのまま、密集地だけが細かいセルで検索される
+    on_resultには各セルの検索結果が検索完了時に渡される
+    on_progressには(検索済みセル数, これまでに検索予定となったセル数)が都度渡される
+    検索予定のセル数はセルを分割するたびに増えるため、固定の総数ではない
+    (全セルの検索結果, 取得に失敗したページがあったか)を返す
+    """
+    point_results = []
+    started = completed = 0
+    total = len(cells)
+    any_failed = False
     
-    return results
+    async def search_cell(cell):
+        nonlocal started, completed, any_failed
+        started += 1
+        result, failed = await search_point(client, sem, cell, started, total)
+        any_failed = any_failed or failed
+        completed += 1
+        if on_result:
+            on_result(result)
+        if on_progress:
+            on_progress(completed, total)
+        return result
+    
+    # 同じ大きさのセルごとにまとめて並行して検索する
+    while cells:
+        next_cells = []
+        for cell, result in zip(cells, await asyncio.gather(*(search_cell(cell) for cell in cells))):
+            point_results.append(result)
+            saturated = tuple(
+                place_type for place_type in cell.place_types
+                if len(result[place_type]) >= SATURATION_THRESHOLD
+            )
+            if saturated and cell.size > MIN_CELL_SIZE:
+                next_cells.extend(subdivide_cell(cell, saturated))
+        if next_cells:
+            logger.info("取得件数が上限に近いため分割して再検索: %dポイント", len(next_cells))
+        total += len(next_cells)
+        cells = next_cells
+    
+    return point_results, any_failed
+
+def classify_place(place: dict, place_type: str) -> str:
+    """
+    検索した種類と店名から店舗のカテゴリを判定
+    """
+    name = place.get('name', '')
+    for category in CATEGORIES:
+        if category.place_type != place_type:
+            continue
+        if category.pattern is None or category.pattern.search(name):
+            return category.key
+
+def match_area_name(address: str) -> str:
+    """
+    住所文字列から市区町村名（政令指定都市は区まで）を取り出す
+    取り出せない場合は空文字を返す
+    """
+    match = AREA_PATTERN.match(address)
+    if not match:
+        return ''
+    return match.group('city') or match.group('town')
+
+@functools.lru_cache(maxsize=20000)
+def lookup_area_name(gmaps, lat, lng):
+    """
+    丸めた座標から地域名を取得（失敗時は例外を送出しキャッシュしない）
+    """
+    key = (AREA_CACHE_VERSION, lat, lng)
+    area = area_cache.get(key)
+    if area is not None:
+        return area
+    
+    area = "地域不明"
+    result = gmaps.reverse_geocode((lat, lng), language="ja")
+    if result:
+        # 検索結果から取り出す場合と同じく市区町村（政令指定都市は区まで）を取得
+        area = match_area_name(result[0]['formatted_address'])
+        if not area:
+            for component in result[0]['address_components']:
+                if 'locality' in component['types']:
+                    area = component['long_name']
+                    break
+            else:
+                area = "地域不明"
+    area_cache.set(key, area, expire=AREA_CACHE_TTL)
+    return area
 
 def get_area_name(gmaps, lat, lng):
     """
     座標から地域名を取得
+    約100m単位に丸めた座標で引くため、近接する店舗は同じ結果を共有する
     """
     try:
-        result = gmaps.reverse_geocode((lat, lng), language="ja")
-        if result:
-            # 最も詳細な地域情報を取得
-            address_components = result[0]['address_components']
-            for component in address_components:
-                if 'sublocality' in component['types']:
-                    return component['long_name']
-            return result[0]['formatted_address'].split(',')[0]
+        return lookup_area_name(gmaps, round(lat, 3), round(lng, 3))
     except Exception as e:
-        logger.error(f"地域名取得エラー: ({lat}, {lng}) - {str(e)}")
+        logger.error("地域名取得エラー: (%s, %s) - %s", lat, lng, e)
         return "地域不明"
-    return "地域不明"
 
-def convert_to_place_info(places: List[dict], category: str, gmaps) -> List[PlaceInfo]:
+def extract_area_name(place: dict) -> str:
     """
-    Google Places APIの結果をPlaceInfo形式に変換
+    Nearby Searchの結果に含まれるplus_code・vicinityから地域名を取り出す
+    取り出せない場合は空文字を返す
     """
-    logger.info(f"{category}の変換開始 - {len(places)}件")
+    compound_code = place.get('plus_code', {}).get('compound_code', '')
+    candidates = (compound_code.split(' ', 1)[-1] if compound_code else '', place.get('vicinity', ''))
+    for address in candidates:
+        area = match_area_name(address)
+        if area:
+            return area
+    return ''
+
+def normalize_address(address: str) -> str:
+    """
+    全角・半角の表記揺れと空白を除いた住所文字列を返す
+    """
+    return "".join(unicodedata.normalize('NFKC', address).split())
+
+def get_places_cache_key(prefecture: str, city: str) -> str:
+    """
+    検索結果キャッシュのキーを生成
+    """
+    key = f"{normalize_address(prefecture)}|{normalize_address(city)}|v{PLACES_CACHE_VERSION}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def convert_to_place_info(places: List[dict], category: str, areas: Dict[str, str]) -> List[dict]:
+    """
+    Google Places APIの結果をPlaceInfo形式の辞書に変換
+    件数が多いためモデルの検証は行わずに辞書のまま返す
+    """
+    logger.info("%sの変換開始 - %d件", category, len(places))
     result = []
     for place in places:
         try:
-            result.append(PlaceInfo(
-                name=place['name'],
-                address=place.get('vicinity', '住所不明'),
-                place_type=category,
-                area=get_area_name(gmaps, place['geometry']['location']['lat'], 
-                                 place['geometry']['location']['lng'])
-            ))
+            result.append({
+                'name': place['name'],
+                'address': place.get('vicinity', '住所不明'),
+                'place_type': category,
+                'area': areas[place['place_id']]
+            })
         except Exception as e:
-            logger.error(f"店舗情報変換エラー: {category} - {str(e)}")
+            logger.error("店舗情報変換エラー: %s - %s", category, e)
     return result
 
-@app.post("/get_place_info", response_model=LocationResponse)
-async def get_place_info(location: LocationRequest):
-    start_time = time.time()
-    logger.info(f"検索開始: {location.prefecture}{location.city}")
+def get_city_bounds(address: str) -> dict:
+    """
+    住所をジオコーディングし、地域の境界を取得
+    市区町村の境界はほぼ変わらないため、正規化した住所ごとに結果をキャッシュする
+    """
+    address = normalize_address(address)
+    geocode_result = geocode_cache.get(address)
+    if geocode_result is None:
+        geocode_result = gmaps.geocode(address)
+        if geocode_result:
+            geocode_cache.set(address, geocode_result, expire=GEOCODE_CACHE_TTL)
+    if not geocode_result:
+        raise HTTPException(status_code=404, detail="指定された住所が見つかりません")
+    
+    bounds = geocode_result[0]['geometry'].get('bounds')
+    if not bounds:
+        bounds = {
+            'northeast': geocode_result[0]['geometry']['location'],
+            'southwest': geocode_result[0]['geometry']['location']
+        }
+    return bounds
+
+async def find_place_info(location: LocationRequest, client: httpx.AsyncClient, sem: asyncio.Semaphore,
+                          on_progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """
+    市区町村内の店舗を検索し、LocationResponse形式の辞書（処理時間を除く）を返す
+    結果はキャッシュに保存し、有効期限内の同じ市区町村の検索にはキャッシュを返す
+    on_progressには(検索済みポイント数, これまでに検索予定となったポイント数)が都度渡される
+    （セルの分割で検索予定のポイント数が増えるため、進捗の割合は途中で下がることがある）
+    """
+    # 同じ市区町村の検索結果がキャッシュにあればそれを返す
+    cache_key = get_places_cache_key(location.prefecture, location.city)
+    cached = places_cache.get(cache_key)
+    if cached is not None:
+        logger.info("キャッシュから応答")
+        return cached
+    
+    # 住所の組み立てと地域の境界の取得
+    # ジオコーディングとキャッシュの読み書きは同期処理のため、他の検索を止めないよう別スレッドで行う
+    bounds = await asyncio.to_thread(get_city_bounds, f"{location.prefecture}{location.city}")
+    
+    # グリッドポイントを生成
+    grid_points = get_area_grid_points(bounds)
+    logger.info("検索ポイント数: %d", len(grid_points))
+    
+    # 検索が済んだポイントから順に、初めて見つかった店舗の地域名の解決を始める
+    # 最後のポイントの検索が終わる頃には大半の地域名が解決済みになる
+    # 検索結果から取り出せない店舗のみ、丸めた座標ごとに1回だけ別スレッドで逆ジオコーディングを行う
+    areas: Dict[str, str] = {}
+    area_lookups: Dict[str, asyncio.Task] = {}
+    lookup_tasks: Dict[Tuple[float, float], asyncio.Task] = {}
+    def start_area_resolution(result):
+        for places in result.values():
+            for place in places:
+                place_id = place['place_id']
+                if place_id in areas or place_id in area_lookups:
+                    continue
+                area = extract_area_name(place)
+                if area:
+                    # 同じ地域名は同じ文字列オブジェクトを共有する
+                    areas[place_id] = sys.intern(area)
+                    continue
+                location = place['geometry']['location']
+                key = (round(location['lat'], 3), round(location['lng'], 3))
+                if key not in lookup_tasks:
+                    lookup_tasks[key] = asyncio.create_task(asyncio.to_thread(get_area_name, gmaps, *key))
+                area_lookups[place_id] = lookup_tasks[key]
     
     try:
-        # 住所の組み立て
-        address = f"{location.prefecture}{location.city}"
-        
-        # 位置情報の取得
-        geocode_result = gmaps.geocode(address)
-        if not geocode_result:
-            raise HTTPException(status_code=404, detail="指定された住所が見つかりません")
-        
-        # 地域の境界を取得
-        bounds = geocode_result[0]['geometry']['bounds']
-        if not bounds:
-            bounds = {
-                'northeast': geocode_result[0]['geometry']['location'],
-                'southwest': geocode_result[0]['geometry']['location']
-            }
-        
-        # グリッドポイントを生成
-        grid_points = get_area_grid_points(bounds)
-        logger.info(f"検索ポイント数: {len(grid_points)}")
-        
-        # 各カテゴリの店舗を格納するリスト
-        all_general_restaurants = []
-        all_izakaya = []
-        all_family_restaurants = []
-        all_ramen_shops = []
-        all_soba_udon = []
-        all_cafes = []
+        # 全グリッドポイントを並行して検索
+        point_results, failed = await search_grid(client, sem, grid_points, start_area_resolution, on_progress)
         
-        # 各グリッドポイントで検索
-        for i, point in enumerate(grid_points, 1):
-            logger.info(f"ポイント {i}/{len(grid_points)} の検索中")
-            # 各カテゴリの店舗を取得
-            all_general_restaurants.extend(get_all_places(gmaps, point, "飲食店", "restaurant"))
-            all_izakaya.extend(get_all_places(gmaps, point, "居酒屋", "restaurant"))
-            all_family_restaurants.extend(get_all_places(gmaps, point, "ファミリーレストラン", "restaurant"))
-            all_ramen_shops.extend(get_all_places(gmaps, point, "ラーメン", "restaurant"))
-            all_soba_udon.extend(get_all_places(gmaps, point, "そば OR うどん", "restaurant"))
-            all_cafes.extend(get_all_places(gmaps, point, "カフェ OR 喫茶店", "cafe"))
-        
-        # 重複を排除（place_idで判断）
+        # 重複を排除（place_idで判断）し、店名からカテゴリに振り分ける
         logger.info("重複排除処理開始")
-        seen_ids = set()
-        unique_general_restaurants = []
-        unique_izakaya = []
-        unique_family_restaurants = []
-        unique_ramen_shops = []
-        unique_soba_udon = []
-        unique_cafes = []
-        
-        for place in all_general_restaurants:
-            if place['place_id'] not in seen_ids:
-                seen_ids.add(place['place_id'])
-                unique_general_restaurants.append(place)
+        unique_places = bucket_places(point_results)
         
-        for place in all_izakaya:
-            if place['place_id'] not in seen_ids:
-                seen_ids.add(place['place_id'])
-                unique_izakaya.append(place)
+        # 逆ジオコーディングの結果を待ち、place_idごとの地域名を揃える
+        await asyncio.gather(*lookup_tasks.values())
+    finally:
+        # 検索が中断された場合（ストリームの切断など）は未完了の逆ジオコーディングを取り消す
+        for lookup_task in lookup_tasks.values():
+            lookup_task.cancel()
+    for place_id, lookup_task in area_lookups.items():
+        areas[place_id] = sys.intern(lookup_task.result())
+    
+    response = {
+        'total_restaurants': sum(len(places) for places in unique_places.values()),
+        **{
+            category.key: convert_to_place_info(unique_places[category.key], category.display_name, areas)
+            for category in CATEGORIES
+        }
+    }
+    # 取得に失敗したページがある場合は不完全な結果のためキャッシュしない
+    # （失敗がなければ、0件の結果はすべての検索がZERO_RESULTSだったことを意味する）
+    if failed:
+        logger.warning("取得に失敗した検索があるため結果をキャッシュしません")
+    else:
+        places_cache.set(cache_key, response, expire=PLACES_CACHE_TTL)
+    return response
+
+def format_event(event: str, data) -> bytes:
+    """
+    Server-Sent Eventsの1イベント分を生成
+    """
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+# レスポンスの形式はLocationResponseとしてドキュメント化し、
+# 実際の返却ではモデルの検証を省いてorjsonで直接シリアライズする
+@app.post("/get_place_info", response_model=LocationResponse)
+async def get_place_info(location: LocationRequest):
+    start_time = time.time()
+    logger.info("検索開始: %s%s", location.prefecture, location.city)
+    
+    try:
+        response = await find_place_info(location, app.state.http_client, app.state.places_semaphore)
         
-        for place in all_family_restaurants:
-            if place['place_id'] not in seen_ids:
-                seen_ids.add(place['place_id'])
-                unique_family_restaurants.append(place)
+        processing_time = time.time() - start_time
+        logger.info("処理完了: 総処理時間 %.2f秒", processing_time)
+        return ORJSONResponse(content={**response, 'processing_time': processing_time})
         
-        for place in all_ramen_shops:
-            if place['place_id'] not in seen_ids:
-                seen_ids.add(place['place_id'])
-                unique_ramen_shops.append(place)
+    except Exception as e:
+        logger.error("エラー発生: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/get_place_info_stream")
+async def get_place_info_stream(prefecture: str, city: str):
+    """
+    検索の進捗とカテゴリごとの結果をServer-Sent Eventsで順次返す
+    - progress: {"completed": 検索済みポイント数, "total": これまでに検索予定となったポイント数}
+      totalはセルの分割で増えるため、completed/totalが途中で下がることがある
+    - category: {"key": カテゴリ, "places": PlaceInfoのリスト}
+    - done: {"total_restaurants": 総店舗数, "processing_time": 処理時間}
+    - error: {"detail": エラー内容}
+    """
+    location = LocationRequest(prefecture=prefecture, city=city)
+    
+    async def generate() -> AsyncIterator[bytes]:
+        start_time = time.time()
+        logger.info("検索開始（ストリーム）: %s%s", location.prefecture, location.city)
+        queue = asyncio.Queue()
+        task = asyncio.create_task(find_place_info(
+            location,
+            app.state.http_client,
+            app.state.places_semaphore,
+            lambda completed, total: queue.put_nowait({'completed': completed, 'total': total})
+        ))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
         
-        for place in all_soba_udon:
-            if place['place_id'] not in seen_ids:
-                seen_ids.add(place['place_id'])
-                unique_soba_udon.append(place)
+        try:
+            while (progress := await queue.get()) is not None:
+                yield format_event("progress", progress)
+            response = task.result()
+        except Exception as e:
+            logger.error("エラー発生: %s", e)
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield format_event("error", {'detail': detail})
+            return
+        finally:
+            task.cancel()
         
-        for place in all_cafes:
-            if place['place_id'] not in seen_ids:
-                seen_ids.add(place['place_id'])
-                unique_cafes.append(place)
+        for category in CATEGORIES:
+            yield format_event("category", {'key': category.key, 'places': response[category.key]})
         
         processing_time = time.time() - start_time
-        logger.info(f"処理完了: 総処理時間 {processing_time:.2f}秒")
-        
-        return LocationResponse(
-            total_restaurants=len(seen_ids),
-            general_restaurants=convert_to_place_info(unique_general_restaurants, "一般飲食店", gmaps),
-            izakaya=convert_to_place_info(unique_izakaya, "居酒屋", gmaps),
-            family_restaurants=convert_to_place_info(unique_family_restaurants, "ファミリーレストラン", gmaps),
-            ramen_shops=convert_to_place_info(unique_ramen_shops, "ラーメン", gmaps),
-            soba_udon_shops=convert_to_place_info(unique_soba_udon, "そば・うどん", gmaps),
-            cafes=convert_to_place_info(unique_cafes, "カフェ", gmaps),
-            processing_time=processing_time
-        )
-        
-    except Exception as e:
-        logger.error(f"エラー発生: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.info("処理完了（ストリーム）: 総処理時間 %.2f秒", processing_time)
+        yield format_event("done", {
+            'total_restaurants': response['total_restaurants'],
+            'processing_time': processing_time
+        })
+    
+    return StreamingResponse(generate(), media_type="text/event-stream")
 
 if __name__ == "__main__":
     import uvicorn
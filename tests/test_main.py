@@ -0,0 +1,86 @@
+import os
+import unittest
+
+# app.mainはインポート時にGoogle Maps APIクライアントを生成するため、ダミーのキーを設定する
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "AIzaTESTKEY000000000000000000000000000000")
+
+from app.main import classify_place, extract_area_name, match_area_name
+
+# (住所, 取り出される市区町村名)
+AREA_CASES = [
+    # formatted_address・plus_codeの形式（国名・郵便番号付き）
+    ("日本、〒150-0041 東京都渋谷区神南１丁目", "渋谷区"),
+    ("日本、〒100-0001 東京都千代田区千代田１−１", "千代田区"),
+    ("〒460-0008 愛知県名古屋市中区栄３丁目", "名古屋市中区"),
+    # 名前の途中に「市」「町」を含む市
+    ("三重県四日市市諏訪町", "四日市市"),
+    ("広島県廿日市市下平良１丁目", "廿日市市"),
+    ("石川県野々市市三納１丁目", "野々市市"),
+    ("新潟県十日町市本町", "十日町市"),
+    ("東京都町田市原町田６丁目", "町田市"),
+    ("町田市原町田６丁目", "町田市"),
+    # 政令指定都市は区まで
+    ("大阪府大阪市北区梅田", "大阪市北区"),
+    ("北海道札幌市中央区北１条西２丁目", "札幌市中央区"),
+    ("神奈川県横浜市中区山下町", "横浜市中区"),
+    # 郡部の町村
+    ("長野県北佐久郡軽井沢町軽井沢", "北佐久郡軽井沢町"),
+    ("北佐久郡軽井沢町軽井沢", "北佐久郡軽井沢町"),
+    # 郡を含まない町村は都道府県の直後にある場合のみ
+    ("東京都大島町元町", "大島町"),
+    # 町名・丁目だけの住所は取り出さない
+    ("東京都千代田区神田神保町１丁目", "千代田区"),
+    ("神田神保町１丁目", ""),
+    ("１丁目２−３", ""),
+    ("", ""),
+]
+
+# (店名, 検索した種類, カテゴリ)
+CLASSIFY_CASES = [
+    ("らーめん太郎", "restaurant", "ramen_shops"),
+    ("中華そば 青葉", "restaurant", "ramen_shops"),
+    ("つけ麺 TETSU", "restaurant", "ramen_shops"),
+    ("手打ちそば 更科", "restaurant", "soba_udon_shops"),
+    ("蕎麦 ふじ", "restaurant", "soba_udon_shops"),
+    ("麺家 讃岐うどん", "restaurant", "soba_udon_shops"),
+    ("焼きそば屋", "restaurant", "general_restaurants"),
+    ("ソース焼きそば 太郎", "restaurant", "general_restaurants"),
+    ("焼そばセンター", "restaurant", "general_restaurants"),
+    ("麺屋 一郎", "restaurant", "general_restaurants"),
+    ("居酒屋はな", "restaurant", "izakaya"),
+    ("やきとり 鳥正", "restaurant", "izakaya"),
+    ("Trattoria X", "restaurant", "general_restaurants"),
+    ("ガスト 渋谷店", "restaurant", "family_restaurants"),
+    ("サイゼリヤ", "restaurant", "family_restaurants"),
+    ("レストランA", "restaurant", "general_restaurants"),
+    ("", "restaurant", "general_restaurants"),
+    # カフェの検索結果は店名に関わらずカフェ
+    ("らーめんカフェ", "cafe", "cafes"),
+    ("喫茶 ふじ", "cafe", "cafes"),
+]
+
+class MatchAreaNameTest(unittest.TestCase):
+    def test_match_area_name(self):
+        for address, expected in AREA_CASES:
+            with self.subTest(address=address):
+                self.assertEqual(match_area_name(address), expected)
+
+    def test_extract_area_name_prefers_plus_code(self):
+        place = {
+            'plus_code': {'compound_code': "MPFV+9G 日本、東京都渋谷区神南１丁目"},
+            'vicinity': "神南１丁目",
+        }
+        self.assertEqual(extract_area_name(place), "渋谷区")
+
+    def test_extract_area_name_falls_back_to_vicinity(self):
+        self.assertEqual(extract_area_name({'vicinity': "十日町市本町"}), "十日町市")
+        self.assertEqual(extract_area_name({'vicinity': "神田神保町１丁目"}), "")
+
+class ClassifyPlaceTest(unittest.TestCase):
+    def test_classify_place(self):
+        for name, place_type, expected in CLASSIFY_CASES:
+            with self.subTest(name=name, place_type=place_type):
+                self.assertEqual(classify_place({'name': name}, place_type), expected)
+
+if __name__ == "__main__":
+    unittest.main()